@@ -0,0 +1,40 @@
+import itertools
+import re
+
+CHUNK_TOKENS = 3000   # target tokens per chunk request
+CHARS_PER_TOKEN = 4   # rough average for English text
+CHUNK_CHARS = CHUNK_TOKENS * CHARS_PER_TOKEN
+PARAGRAPH_BREAK_RE = re.compile(r"\n{2,}")   # blank line(s) between paragraphs
+
+
+def chunk_text(text, max_chars=CHUNK_CHARS):
+    """Split text into non-blank chunks of at most max_chars, preferring paragraph breaks."""
+    # Track the current chunk as offsets into text so each chunk is sliced exactly once
+    chunks, start, end, pos = [], 0, None, 0
+    for brk in itertools.chain(PARAGRAPH_BREAK_RE.finditer(text), [None]):
+        para_end = len(text) if brk is None else brk.start()
+        if end is not None and para_end - start > max_chars:
+            chunks.append(text[start:end])
+            start, end = pos, None
+        # Hard-split paragraphs that are longer than a whole chunk
+        while para_end - start > max_chars:
+            chunks.append(text[start:start + max_chars])
+            start += max_chars
+        end = para_end
+        if brk is not None:
+            pos = brk.end()
+    chunks.append(text[start:end])
+    # Leading breaks or blank pages leave whitespace-only slices; never send those to the model
+    return [chunk for chunk in chunks if not chunk.isspace() and chunk]
+
+
+def iter_chunks(pages, max_chars=CHUNK_CHARS):
+    """Pack a stream of pages into chunks of at most max_chars as soon as they fill."""
+    buffer = ""
+    for page in pages:
+        buffer += page
+        if len(buffer) > max_chars:
+            *full, buffer = chunk_text(buffer, max_chars) or [""]
+            yield from full
+    if buffer.strip():
+        yield buffer
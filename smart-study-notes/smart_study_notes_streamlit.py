@@ -1,7 +1,59 @@
 import streamlit as st
 import pdfplumber
 import os
+import asyncio
+import hashlib
+import io
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import Iterator, Protocol
+import numpy as np
+from charset_normalizer import from_bytes
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from chunking import CHARS_PER_TOKEN, iter_chunks
+
+try:
+    import pymupdf  # much faster text extraction than pdfplumber
+    PYMUPDF_AVAILABLE = True
+except ImportError:
+    PYMUPDF_AVAILABLE = False
+
+try:
+    import yake  # local keyword extraction, no API call needed
+    YAKE_AVAILABLE = True
+except ImportError:
+    YAKE_AVAILABLE = False
+
+MODEL_NAME = "gemini-1.5-flash-latest"
+PROMPT_OVERHEAD_TOKENS = 500   # instructions wrapped around the text
+MAX_CONCURRENCY = 8   # parallel chunk requests in flight
+TEXT_BLOCK_CHARS = 65536   # characters decoded at a time from .txt uploads
+
+# On-disk cache of extracted PDF text and of chunk summaries
+# (summaries match on exact SHA-256, then on embedding similarity)
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".smart_study_cache", "summaries.db")
+EMBED_MODEL = "models/text-embedding-004"
+EMBED_WINDOW_CHARS = 4000   # stays under the embedding model's 2,048-token input limit
+SIMILARITY_THRESHOLD = 0.97   # cosine similarity for a near-duplicate hit
+SUMMARY_TTL_SECONDS = 86400   # chunk summaries expire after a day
+PDF_CACHE_ENTRIES = 32   # extracted PDF texts kept, newest first
+
+logger = logging.getLogger(__name__)
+
+# Transient Gemini API errors worth retrying (rate limits, timeouts, 5xx)
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+)
 
 # ---------------------------------------------------------
 # 🧠 SMART STUDY NOTES GENERATOR (Gemini Free API)
@@ -21,8 +73,382 @@ if not api_key:
     st.info("Create one at [https://aistudio.google.com/app/apikey](https://aistudio.google.com/app/apikey)")
     st.stop()
 
-# Configure Gemini client
-genai.configure(api_key=api_key)
+# Configure Gemini client once per key; reconfiguring on every rerun drops its open connections
+@st.cache_resource(show_spinner=False)
+def get_model(key_hash, _api_key):
+    """Return a Gemini model whose client is reused across Streamlit reruns."""
+    genai.configure(api_key=_api_key)
+    return genai.GenerativeModel(MODEL_NAME)
+
+
+# Cache on a hash so the key itself never becomes a cache key
+key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+model = get_model(key_hash, api_key)
+
+# ---------------------------------------------------------
+# 🧩 Helpers
+# ---------------------------------------------------------
+# Retry transient errors with jittered exponential backoff
+_with_retry = retry(
+    stop=stop_after_attempt(3),
+    wait=wait_random_exponential(min=1, max=20),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    reraise=True,
+)
+
+
+class RateLimiter:
+    """Thread-safe token bucket that caps requests and tokens per minute."""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.requests = float(requests_per_minute)
+        self.tokens = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        """Refill both buckets in proportion to the time since the last update (lock held)."""
+        now = time.monotonic()
+        elapsed, self.updated = now - self.updated, now
+        self.requests = min(self.requests_per_minute, self.requests + elapsed * self.requests_per_minute / 60)
+        self.tokens = min(self.tokens_per_minute, self.tokens + elapsed * self.tokens_per_minute / 60)
+
+    def set_rates(self, requests_per_minute, tokens_per_minute):
+        """Change the limits in place, without refilling the buckets."""
+        with self.lock:
+            self._refill()
+            self.requests_per_minute = requests_per_minute
+            self.tokens_per_minute = tokens_per_minute
+            self.requests = min(self.requests, requests_per_minute)
+            self.tokens = min(self.tokens, tokens_per_minute)
+
+    def acquire(self, tokens):
+        """Block until a request of the given size fits within both limits."""
+        tokens = min(tokens, self.tokens_per_minute)  # an oversized prompt waits for a full bucket
+        while True:
+            with self.lock:
+                self._refill()
+                if self.requests >= 1 and self.tokens >= tokens:
+                    self.requests -= 1
+                    self.tokens -= tokens
+                    return
+                wait = max(
+                    (1 - self.requests) * 60 / self.requests_per_minute,
+                    (tokens - self.tokens) * 60 / self.tokens_per_minute,
+                )
+            time.sleep(wait)
+
+
+@st.cache_resource(show_spinner=False)
+def get_rate_limiter(key_hash, _requests_per_minute, _tokens_per_minute):
+    """Return the process-wide limiter of an API key, shared across reruns and sessions."""
+    return RateLimiter(_requests_per_minute, _tokens_per_minute)
+
+
+class LLMBackend(Protocol):
+    """What the study-notes pipeline needs from a model provider."""
+
+    name: str  # identifies the model in cache keys
+
+    def chat(self, prompt: str) -> str:
+        """Return the full response to prompt."""
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Yield the response to prompt piece by piece as it is generated."""
+
+    def embed(self, text: str) -> np.ndarray:
+        """Return unit-length embedding vectors of text, one row per fixed-size window."""
+
+    def count_tokens(self, text: str) -> int:
+        """Return the number of tokens text takes up."""
+
+    def input_token_limit(self) -> int:
+        """Return the size of the model's context window in tokens."""
+
+
+@st.cache_data(show_spinner=False)
+def _input_token_limit(model_name):
+    """Look up the context window of a Gemini model."""
+    return genai.get_model(model_name).input_token_limit
+
+
+class GeminiBackend:
+    """LLMBackend for Gemini, with retries and rate limiting on every generation request."""
+
+    def __init__(self, model, limiter):
+        self.model = model
+        self.name = model.model_name
+        self.limiter = limiter
+
+    @_with_retry
+    def _generate(self, prompt, **kwargs):
+        self.limiter.acquire(len(prompt) // CHARS_PER_TOKEN)
+        return self.model.generate_content(prompt, **kwargs)
+
+    def chat(self, prompt):
+        return self._generate(prompt).text.strip()
+
+    def stream(self, prompt):
+        for part in self._generate(prompt, stream=True):
+            if part.parts:
+                yield part.text
+
+    def embed(self, text):
+        # Not retried (not even by the client library): a failed embedding falls back to
+        # summarizing the chunk right away. Embed every window instead of letting the API silently drop the tail of the text
+        windows = [text[i:i + EMBED_WINDOW_CHARS] for i in range(0, len(text), EMBED_WINDOW_CHARS)]
+        result = genai.embed_content(
+            model=EMBED_MODEL, content=windows or [text], request_options={"retry": None}
+        )
+        vectors = np.asarray(result["embedding"], dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    @_with_retry
+    def count_tokens(self, text):
+        return self.model.count_tokens(text).total_tokens
+
+    def input_token_limit(self):
+        return _input_token_limit(self.name)
+
+
+def fit_to_context(backend: LLMBackend, text):
+    """Truncate text so a prompt built around it fits the model's context window."""
+    budget = backend.input_token_limit() - PROMPT_OVERHEAD_TOKENS
+    # Even byte-level tokens cover a quarter of a character, so short texts need no counting
+    if len(text) * 4 <= budget:
+        return text
+    tokens = backend.count_tokens(text)
+    while tokens > budget:
+        text = text[: int(len(text) * budget / tokens * 0.95)]
+        tokens = backend.count_tokens(text)
+    return text
+
+
+@st.cache_resource(show_spinner=False)
+def _create_cache_schema():
+    """Create the on-disk cache tables once per process."""
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    with closing(sqlite3.connect(CACHE_PATH, timeout=30)) as conn:
+        conn.executescript(
+            "CREATE TABLE IF NOT EXISTS chunk_summaries "
+            "(hash TEXT, model TEXT, embedding BLOB, summary TEXT, created REAL, PRIMARY KEY (hash, model));"
+            "CREATE INDEX IF NOT EXISTS chunk_summaries_created ON chunk_summaries (created);"
+            "CREATE TABLE IF NOT EXISTS pdf_texts (hash TEXT PRIMARY KEY, text TEXT, created REAL);"
+        )
+
+
+def _open_cache():
+    """Open the on-disk cache (its tables are created by _create_cache_schema)."""
+    return sqlite3.connect(CACHE_PATH, timeout=30)
+
+
+def _prune_summaries():
+    """Drop expired chunk summaries so lookups only ever scan live rows."""
+    with closing(_open_cache()) as conn, conn:
+        conn.execute("DELETE FROM chunk_summaries WHERE created < ?", (time.time() - SUMMARY_TTL_SECONDS,))
+
+
+def _summarize_one(backend: LLMBackend, chunk):
+    """Summarize one chunk, reusing cached notes for identical or near-identical text."""
+    chunk_hash = hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+    cutoff = time.time() - SUMMARY_TTL_SECONDS
+
+    with closing(_open_cache()) as conn:
+        # Tier 1: exact match on the chunk hash
+        row = conn.execute(
+            "SELECT summary FROM chunk_summaries WHERE hash = ? AND model = ? AND created >= ?",
+            (chunk_hash, backend.name, cutoff),
+        ).fetchone()
+        if row:
+            return row[0]
+
+        # Tier 2: closest previously summarized chunk by cosine similarity. The embedding
+        # only saves a request, so if it fails the chunk is simply summarized
+        try:
+            vectors = backend.embed(chunk)
+        except Exception as e:
+            logger.warning("Embedding failed, skipping the similarity cache: %s", e)
+            vectors = None
+
+        if vectors is not None:
+            # Only chunks with the same number of windows are comparable
+            rows = conn.execute(
+                "SELECT embedding, summary FROM chunk_summaries "
+                "WHERE model = ? AND created >= ? AND length(embedding) = ?",
+                (backend.name, cutoff, vectors.nbytes),
+            ).fetchall()
+            if rows:
+                stored = np.stack(
+                    [np.frombuffer(blob, dtype=np.float32).reshape(vectors.shape) for blob, _ in rows]
+                )
+                # Every window has to match, so an edit anywhere in the chunk is a miss
+                scores = np.einsum("rwd,wd->rw", stored, vectors).min(axis=1)
+                best = int(np.argmax(scores))
+                if scores[best] >= SIMILARITY_THRESHOLD:
+                    return rows[best][1]
+
+    prompt = f"""
+    You are a helpful study assistant.
+    Summarize the following part of a lecture into concise, bullet-point study notes.
+
+    Text:
+    {chunk}
+    """
+    summary = backend.chat(prompt)
+
+    with closing(_open_cache()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO chunk_summaries VALUES (?, ?, ?, ?, ?)",
+            (chunk_hash, backend.name, None if vectors is None else vectors.tobytes(), summary, time.time()),
+        )
+    return summary
+
+
+@st.cache_resource(show_spinner=False)
+def _keyword_extractor():
+    """Build the YAKE extractor once per process."""
+    return yake.KeywordExtractor(lan="en", n=3, top=20)
+
+
+def extract_key_terms(text):
+    """Extract the most important terms and phrases of text locally."""
+    return [keyword for keyword, _ in _keyword_extractor().extract_keywords(text)]
+
+
+def iter_pdf_pages(file):
+    """Yield the text of each PDF page without holding the whole document in memory."""
+    if PYMUPDF_AVAILABLE:
+        # PyMuPDF copies a BytesIO via getvalue(), but reads a memoryview in place
+        view = file.getbuffer()
+        # Fall back to pdfplumber only if PyMuPDF cannot open the file
+        try:
+            doc = pymupdf.open(stream=view, filetype="pdf")
+        except Exception:
+            view.release()
+            file.seek(0)
+        else:
+            with view, doc:
+                for page in doc:
+                    yield page.get_text()
+            return
+
+    with pdfplumber.open(file) as pdf:
+        for page in pdf.pages:
+            yield page.extract_text() or ""
+            page.close()  # drop pdfplumber's per-page layout cache
+
+
+def _iter_cached_pdf_pages(file):
+    """Yield PDF pages, reusing the text extracted from an identical upload before."""
+    with file.getbuffer() as view:
+        file_hash = hashlib.sha256(view).hexdigest()
+
+    with closing(_open_cache()) as conn:
+        row = conn.execute("SELECT text FROM pdf_texts WHERE hash = ?", (file_hash,)).fetchone()
+    if row:
+        yield row[0]
+        return
+
+    pages = []
+    for page in iter_pdf_pages(file):
+        pages.append(page + "\n\n")
+        yield pages[-1]
+
+    # Only reached once the whole document has been read
+    with closing(_open_cache()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO pdf_texts VALUES (?, ?, ?)", (file_hash, "".join(pages), time.time())
+        )
+        # Keep only the most recently extracted documents
+        conn.execute(
+            "DELETE FROM pdf_texts WHERE hash NOT IN "
+            "(SELECT hash FROM pdf_texts ORDER BY created DESC LIMIT ?)",
+            (PDF_CACHE_ENTRIES,),
+        )
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _detect_encoding(file_hash, _data):
+    """Detect the encoding of a text upload instead of assuming UTF-8."""
+    # charset-normalizer samples the whole buffer itself, whereas a fixed-size cut can
+    # split a multibyte character; it only accepts bytes, hence the one-off copy
+    match = from_bytes(bytes(_data)).best()
+    encoding = match.encoding if match else "utf_8"
+    if encoding in ("ascii", "utf_8"):
+        encoding = "utf-8-sig"  # a superset of ASCII that also drops a UTF-8 BOM
+    return encoding
+
+
+def iter_pages(uploaded_file):
+    """Yield the text of an upload piece by piece: PDF pages, or blocks of a .txt file."""
+    uploaded_file.seek(0)
+    if uploaded_file.type == "application/pdf":
+        yield from _iter_cached_pdf_pages(uploaded_file)
+    else:
+        # Hashing the buffer in place is cheap; only a new upload pays for detection
+        with uploaded_file.getbuffer() as view:
+            encoding = _detect_encoding(hashlib.sha256(view).hexdigest(), view)
+
+        # Decode incrementally instead of copying the whole file into one string;
+        # universal newlines turn \r\n and \r into \n on the way
+        reader = io.TextIOWrapper(uploaded_file, encoding=encoding, errors="replace")
+        try:
+            while block := reader.read(TEXT_BLOCK_CHARS):
+                yield block
+        finally:
+            reader.detach()  # keep the upload open for later reruns
+
+
+async def summarize_chunks(backend: LLMBackend, chunks):
+    """Summarize chunks concurrently as they are produced, returning notes in chunk order."""
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    # One thread per in-flight request plus one for parsing, so parsing never queues
+    # behind requests that are sleeping in the rate limiter
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY + 1) as executor:
+
+        async def summarize(chunk):
+            async with semaphore:
+                # Backends are blocking, so run each request in a worker thread
+                return await loop.run_in_executor(executor, _summarize_one, backend, chunk)
+
+        # Parse the next chunk off the event loop while earlier chunks are in flight
+        tasks, by_hash = [], {}
+        while (chunk := await loop.run_in_executor(executor, next, chunks, None)) is not None:
+            # Repeated chunks (slide headers, boilerplate) share a single request
+            chunk_hash = hashlib.sha256(chunk.encode("utf-8")).digest()
+            if chunk_hash not in by_hash:
+                by_hash[chunk_hash] = asyncio.create_task(summarize(chunk))
+            tasks.append(by_hash[chunk_hash])
+        return await asyncio.gather(*tasks)
+
+# Create the cache tables before the preview or a summary run reads them
+_create_cache_schema()
+
+# ---------------------------------------------------------
+# ⚙️ Settings
+# ---------------------------------------------------------
+use_llm_key_terms = st.sidebar.checkbox(
+    "🤖 Use Gemini for key terms",
+    value=not YAKE_AVAILABLE,
+    disabled=not YAKE_AVAILABLE,
+    help="By default key terms are extracted locally with YAKE, without an API call.",
+)
+
+# Defaults match the Gemini free tier; raise them for paid keys
+max_requests_per_minute = st.sidebar.number_input("⏱️ Max requests per minute", min_value=1, value=15)
+max_tokens_per_minute = st.sidebar.number_input(
+    "🔢 Max tokens per minute", min_value=1000, value=1_000_000, step=1000
+)
+# The quota belongs to the key, so changing the settings adjusts its limiter rather
+# than starting a fresh, full bucket
+limiter = get_rate_limiter(key_hash, max_requests_per_minute, max_tokens_per_minute)
+limiter.set_rates(max_requests_per_minute, max_tokens_per_minute)
+
+backend: LLMBackend = GeminiBackend(model, limiter)
 
 # ---------------------------------------------------------
 # 📂 Upload section
@@ -30,14 +456,13 @@ genai.configure(api_key=api_key)
 uploaded_file = st.file_uploader("📄 Upload your lecture notes (.pdf or .txt)", type=["pdf", "txt"])
 
 if uploaded_file:
-    # Extract text
-    if uploaded_file.type == "application/pdf":
-        with pdfplumber.open(uploaded_file) as pdf:
-            text = ""
-            for page in pdf.pages:
-                text += page.extract_text() or ""
-    else:
-        text = uploaded_file.read().decode("utf-8")
+    # Extract just enough text for the preview; the full document is streamed on generate
+    text = ""
+    with closing(iter_pages(uploaded_file)) as pages:
+        for page in pages:
+            text += page
+            if len(text.strip()) >= 1000:
+                break
 
     if not text.strip():
         st.warning("⚠️ No readable text found in the file.")
@@ -52,23 +477,50 @@ if uploaded_file:
     if st.button("✨ Generate Study Notes and Quiz"):
         with st.spinner("Generating notes using Gemini... ⏳"):
             try:
+                # Long documents: summarize chunks in parallel while the rest is parsed, then combine
+                with closing(iter_pages(uploaded_file)) as pages:
+                    chunks = iter_chunks(pages)
+                    first, second = next(chunks, ""), next(chunks, None)
+                    if second is not None:
+                        chunks = itertools.chain([first, second], chunks)
+                        _prune_summaries()
+                        source = "\n\n".join(asyncio.run(summarize_chunks(backend, chunks)))
+                    else:
+                        source = first
+
+                sections = ["## 📘 Study Notes: concise, bullet-point study notes"]
+                if use_llm_key_terms:
+                    sections.append("## 🔑 Key Terms: the 10–20 most important terms and concepts, comma-separated")
+                sections.append("## 📝 Quiz: 5–10 quiz questions to test understanding of the material")
+                sections = "\n".join(sections)
+
                 prompt = f"""
                 You are a helpful study assistant.
-                Summarize the following text into concise, bullet-point study notes.
-                Then create 5–10 quiz questions to test understanding of the material.
+                From the following text, write Markdown with exactly these sections:
+                {sections}
 
                 Text:
-                {text[:12000]}
+                {fit_to_context(backend, source)}
                 """
 
-                # Supported model
-                model = genai.GenerativeModel("gemini-1.5-flash-latest")
-                response = model.generate_content(prompt)
+                # Extract key terms locally while Gemini is still writing the notes
+                key_terms_future = None
+                if not use_llm_key_terms:
+                    executor = ThreadPoolExecutor(max_workers=1)
+                    key_terms_future = executor.submit(extract_key_terms, source)
+                    executor.shutdown(wait=False)  # the worker exits once extraction is done
 
-                result = response.text.strip()
+                # Show the answer as it is generated instead of after the full response
+                placeholder = st.empty()
+                result = ""
+                for piece in backend.stream(prompt):
+                    result += piece
+                    placeholder.markdown(result)
 
-                st.subheader("📘 Study Notes & Quiz")
-                st.write(result)
+                if key_terms_future is not None:
+                    key_terms = "## 🔑 Key Terms\n\n" + ", ".join(key_terms_future.result())
+                    st.markdown(key_terms)
+                    result += "\n\n" + key_terms
 
                 st.download_button(
                     label="📥 Download Summary",
@@ -0,0 +1,49 @@
+import os
+import random
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunking import chunk_text, iter_chunks
+
+
+def _content(text):
+    """Text without whitespace, which chunking may drop at chunk boundaries."""
+    return re.sub(r"\s", "", text)
+
+
+def test_leading_break_does_not_emit_empty_chunk():
+    assert chunk_text("\n\nabc", 3) == ["abc"]
+
+
+def test_blank_pages_do_not_emit_empty_chunks():
+    chunks = list(iter_chunks(["\n\n\n\n" + "x" * 20000], 12000))
+    assert [len(chunk) for chunk in chunks] == [12000, 8000]
+
+
+def test_paragraphs_are_kept_together():
+    assert chunk_text("aaa\n\nbbb\n\nccc", 8) == ["aaa\n\nbbb", "ccc"]
+
+
+def test_chunk_text_random_inputs():
+    rng = random.Random(0)
+    for _ in range(20000):
+        text = "".join(rng.choice("ab \n") for _ in range(rng.randint(0, 60)))
+        max_chars = rng.randint(1, 15)
+        chunks = chunk_text(text, max_chars)
+        assert all(0 < len(chunk) <= max_chars and chunk.strip() for chunk in chunks)
+        assert _content("".join(chunks)) == _content(text)
+
+
+def test_iter_chunks_random_pages():
+    rng = random.Random(1)
+    for _ in range(20000):
+        pages = [
+            "".join(rng.choice("ab \n") for _ in range(rng.randint(0, 20)))
+            for _ in range(rng.randint(0, 5))
+        ]
+        max_chars = rng.randint(1, 15)
+        chunks = list(iter_chunks(pages, max_chars))
+        assert all(0 < len(chunk) <= max_chars and chunk.strip() for chunk in chunks)
+        assert _content("".join(chunks)) == _content("".join(pages))